@@ -0,0 +1,227 @@
+"""
+星表ストアとORM経路のワーカーあたりメモリ使用量（RSS）を比較するベンチマーク
+
+使い方（src/backend で実行）:
+    python benchmarks/catalog_memory.py --stars 100000
+
+合成した星表を一時SQLiteに投入し、各経路を別プロセスで実行して
+/constellations 相当のレスポンスを繰り返し構築した後のRSSを測定する。
+"""
+
+import argparse
+import gc
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from models import Base, Constellation, ConstellationLine, Star  # noqa: E402
+
+CONSTELLATION_COUNT = 88
+
+
+def _rss_mb():
+    """現在のRSSと最大RSS（MB）を /proc から読む"""
+    values = {}
+    with open("/proc/self/status", encoding="utf-8") as status:
+        for line in status:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(value.split()[0]) / 1024
+    return values["VmRSS"], values["VmHWM"]
+
+
+def populate(database_url, star_count):
+    """合成した星・星座・星座線を投入する"""
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(0)
+    with engine.begin() as connection:
+        connection.execute(
+            Constellation.__table__.insert(),
+            [
+                {
+                    "id": i + 1,
+                    "name": f"Constellation {i}",
+                    "name_jp": f"星座{i}",
+                    "abbreviation": f"C{i:02d}",
+                    "season": rng.choice(["春", "夏", "秋", "冬"]),
+                    "right_ascension_center": rng.uniform(0, 360),
+                    "declination_center": rng.uniform(-90, 90),
+                    "description": f"合成データの星座 {i}",
+                }
+                for i in range(CONSTELLATION_COUNT)
+            ],
+        )
+        connection.execute(
+            Star.__table__.insert(),
+            [
+                {
+                    "id": i + 1,
+                    "hip_number": i + 1,
+                    "name": f"HIP {i + 1}",
+                    "common_name_jp": None,
+                    "bayer_designation": None,
+                    "right_ascension": rng.uniform(0, 360),
+                    "declination": rng.uniform(-90, 90),
+                    "magnitude": rng.uniform(-1.5, 9.0),
+                    "constellation_id": i % CONSTELLATION_COUNT + 1,
+                }
+                for i in range(star_count)
+            ],
+        )
+        connection.execute(
+            ConstellationLine.__table__.insert(),
+            [
+                {
+                    "constellation_id": c + 1,
+                    "star1_id": c + 1 + CONSTELLATION_COUNT * j,
+                    "star2_id": c + 1 + CONSTELLATION_COUNT * (j + 1),
+                }
+                for c in range(CONSTELLATION_COUNT)
+                for j in range(10)
+                if c + 1 + CONSTELLATION_COUNT * (j + 1) <= star_count
+            ],
+        )
+    engine.dispose()
+
+
+def _orm_payload(db):
+    """従来のORMオブジェクト経由の /constellations 構築（ベースラインと同じ形式）"""
+    constellations = db.query(Constellation).all()
+
+    result = {"constellations": []}
+
+    for constellation in constellations:
+        stars_data = []
+        for star in constellation.stars:
+            stars_data.append(
+                {
+                    "name": star.name,
+                    "right_ascension": star.right_ascension,
+                    "declination": star.declination,
+                    "magnitude": star.magnitude,
+                }
+            )
+
+        # 星座線のデータを取得
+        lines_data = []
+        for line in constellation.lines:
+            star1 = db.query(Star).filter(Star.id == line.star1_id).first()
+            star2 = db.query(Star).filter(Star.id == line.star2_id).first()
+            if star1 and star2:
+                lines_data.append(
+                    {
+                        "star1": {
+                            "name": star1.name,
+                            "right_ascension": star1.right_ascension,
+                            "declination": star1.declination,
+                        },
+                        "star2": {
+                            "name": star2.name,
+                            "right_ascension": star2.right_ascension,
+                            "declination": star2.declination,
+                        },
+                    }
+                )
+
+        result["constellations"].append(
+            {
+                "name": constellation.name,
+                "name_jp": constellation.name_jp,
+                "description": constellation.description,
+                "right_ascension_center": constellation.right_ascension_center,
+                "declination_center": constellation.declination_center,
+                "stars": stars_data,
+                "lines": lines_data,
+            }
+        )
+
+    return result
+
+
+def run_worker(mode, database_url, requests):
+    """1つの経路をこのプロセスで実行し、RSSと処理時間を出力する"""
+    from catalog_store import CatalogStore
+
+    engine = create_engine(database_url)
+    session_factory = sessionmaker(bind=engine)
+    gc.collect()
+    baseline, _ = _rss_mb()
+
+    store = None
+    loaded = baseline
+    if mode == "store":
+        db = session_factory()
+        store = CatalogStore.from_session(db)
+        db.close()
+    gc.collect()
+    loaded, _ = _rss_mb()
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        if mode == "store":
+            payload = {"constellations": store.constellations_payload()}
+        else:
+            db = session_factory()
+            payload = _orm_payload(db)
+            db.close()
+        del payload
+    elapsed = (time.perf_counter() - started) / requests
+
+    gc.collect()
+    rss, peak = _rss_mb()
+    print(
+        f"{mode}\t{loaded - baseline:.1f}\t{rss - baseline:.1f}\t{peak - baseline:.1f}\t{elapsed * 1000:.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stars", type=int, default=100_000, help="合成する星の数")
+    parser.add_argument(
+        "--requests", type=int, default=5, help="レスポンス構築の繰り返し回数"
+    )
+    parser.add_argument("--worker", choices=["orm", "store"], help=argparse.SUPPRESS)
+    parser.add_argument("--database-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.database_url, args.requests)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        print(f"{args.stars} 個の星を投入しています...")
+        populate(database_url, args.stars)
+
+        print("経路\t常駐データ(MB)\tRSS増加(MB)\t最大RSS増加(MB)\t1リクエスト(ms)")
+        for mode in ("orm", "store"):
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    "--worker",
+                    mode,
+                    "--database-url",
+                    database_url,
+                    "--requests",
+                    str(args.requests),
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            print(output.stdout.strip())
+
+
+if __name__ == "__main__":
+    main()
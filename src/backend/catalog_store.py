@@ -0,0 +1,484 @@
+"""
+読み取り専用のインメモリ星表ストア
+
+起動時にDBから一度だけ読み込み、数値列はNumPyの構造化配列、
+名前などの文字列はインターンした文字列テーブル、星座の所属と星座線は
+整数インデックス配列として保持する。リクエストごとにORMオブジェクトを
+生成しないため、割り当てとGCの負荷が小さい。
+"""
+
+import asyncio
+
+import numpy as np
+from sqlalchemy import inspect
+
+from models import (
+    CATALOG_VERSION_ID,
+    CatalogVersion,
+    Constellation,
+    ConstellationLine,
+    Star,
+)
+from star_index import StarIndex
+
+# 文字列がNoneの場合のインデックス
+NO_STRING = -1
+
+# DBから行を読み込む際のチャンクサイズ
+_CHUNK_SIZE = 10000
+
+# 読み込み中に星表が更新された場合の再試行回数
+_MAX_LOAD_ATTEMPTS = 3
+
+STAR_DTYPE = np.dtype(
+    [
+        ("id", "i8"),
+        ("hip_number", "i8"),
+        ("right_ascension", "f8"),
+        ("declination", "f8"),
+        ("magnitude", "f8"),
+        ("constellation", "i4"),  # constellations配列の行番号（所属なしは-1）
+        ("name", "i4"),
+        ("name_jp", "i4"),
+        ("bayer_designation", "i4"),
+    ]
+)
+
+CONSTELLATION_DTYPE = np.dtype(
+    [
+        ("id", "i8"),
+        ("right_ascension_center", "f8"),
+        ("declination_center", "f8"),
+        ("name", "i4"),
+        ("name_jp", "i4"),
+        ("abbreviation", "i4"),
+        ("season", "i4"),
+        ("description", "i4"),
+    ]
+)
+
+
+class _StringTable:
+    """文字列をインターンして整数インデックスを割り当てる"""
+
+    def __init__(self):
+        self._index = {}
+        self.values = []
+
+    def add(self, value):
+        if value is None:
+            return NO_STRING
+        index = self._index.get(value)
+        if index is None:
+            index = len(self.values)
+            self._index[value] = index
+            self.values.append(value)
+        return index
+
+
+def _float(value):
+    return np.nan if value is None else value
+
+
+def _float_column(values):
+    """NaNで保存した欠損値をNoneに戻したリスト（JSONはNaNを扱えない）"""
+    return [None if value != value else value for value in values.tolist()]
+
+
+def _int(value):
+    return -1 if value is None else value
+
+
+class CatalogStore:
+    """星・星座・星座線の読み取り専用スナップショット"""
+
+    def __init__(
+        self,
+        stars,
+        constellations,
+        strings,
+        members,
+        member_offsets,
+        lines,
+        line_offsets,
+        version=None,
+    ):
+        self.stars = stars
+        self.constellations = constellations
+        self.strings = tuple(strings)
+        # 部分一致検索用に小文字化した文字列テーブル
+        self._lowered = tuple(s.lower() for s in self.strings)
+        # 星座ごとの所属星（starsの行番号）: members[member_offsets[i]:member_offsets[i + 1]]
+        self.members = members
+        self.member_offsets = member_offsets
+        # 星座線（starsの行番号のペア）: lines[line_offsets[i]:line_offsets[i + 1]]
+        self.lines = lines
+        self.line_offsets = line_offsets
+        self.version = version
+        # クリック位置の同定などに使う最近傍検索インデックス
+        self.star_index = StarIndex(stars)
+
+        for array in (
+            stars,
+            constellations,
+            members,
+            member_offsets,
+            lines,
+            line_offsets,
+        ):
+            array.flags.writeable = False
+
+    @classmethod
+    def from_session(cls, db, version=None):
+        """DBセッションから列の値だけを読み込んでストアを構築する"""
+        strings = _StringTable()
+
+        constellation_rows = (
+            db.query(
+                Constellation.id,
+                Constellation.right_ascension_center,
+                Constellation.declination_center,
+                Constellation.name,
+                Constellation.name_jp,
+                Constellation.abbreviation,
+                Constellation.season,
+                Constellation.description,
+            )
+            .order_by(Constellation.id)
+            .all()
+        )
+        constellations = np.array(
+            [
+                (
+                    row.id,
+                    _float(row.right_ascension_center),
+                    _float(row.declination_center),
+                    strings.add(row.name),
+                    strings.add(row.name_jp),
+                    strings.add(row.abbreviation),
+                    strings.add(row.season),
+                    strings.add(row.description),
+                )
+                for row in constellation_rows
+            ],
+            dtype=CONSTELLATION_DTYPE,
+        )
+        constellation_row_by_id = {
+            cid: i for i, cid in enumerate(constellations["id"].tolist())
+        }
+
+        star_rows = (
+            db.query(
+                Star.id,
+                Star.hip_number,
+                Star.right_ascension,
+                Star.declination,
+                Star.magnitude,
+                Star.constellation_id,
+                Star.name,
+                Star.common_name_jp,
+                Star.bayer_designation,
+            )
+            .order_by(Star.id)
+            .yield_per(_CHUNK_SIZE)
+        )
+        # 行を逐次配列に変換し、一時的なRowオブジェクトを溜め込まない
+        stars = np.fromiter(
+            (
+                (
+                    row.id,
+                    _int(row.hip_number),
+                    _float(row.right_ascension),
+                    _float(row.declination),
+                    _float(row.magnitude),
+                    constellation_row_by_id.get(row.constellation_id, -1),
+                    strings.add(row.name),
+                    strings.add(row.common_name_jp),
+                    strings.add(row.bayer_designation),
+                )
+                for row in star_rows
+            ),
+            dtype=STAR_DTYPE,
+        )
+
+        # 星座の所属をCSR形式のインデックス配列にする（星座内はid順）
+        order = np.argsort(stars["constellation"], kind="stable")
+        order = order[stars["constellation"][order] >= 0]
+        members = order.astype(np.int32)
+        counts = np.bincount(
+            stars["constellation"][members], minlength=len(constellations)
+        )
+        member_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        line_rows = (
+            db.query(
+                ConstellationLine.constellation_id,
+                ConstellationLine.star1_id,
+                ConstellationLine.star2_id,
+            )
+            .order_by(ConstellationLine.id)
+            .yield_per(_CHUNK_SIZE)
+        )
+        star_row_by_id = {sid: i for i, sid in enumerate(stars["id"].tolist())}
+        line_groups = [[] for _ in range(len(constellations))]
+        for row in line_rows:
+            constellation_row = constellation_row_by_id.get(row.constellation_id)
+            star1 = star_row_by_id.get(row.star1_id)
+            star2 = star_row_by_id.get(row.star2_id)
+            # 参照先の星が存在しない線は従来通り除外する
+            if constellation_row is None or star1 is None or star2 is None:
+                continue
+            line_groups[constellation_row].append((star1, star2))
+        lines = np.array(
+            [pair for group in line_groups for pair in group], dtype=np.int32
+        ).reshape(-1, 2)
+        line_offsets = np.concatenate(
+            ([0], np.cumsum([len(group) for group in line_groups]))
+        ).astype(np.int64)
+
+        return cls(
+            stars,
+            constellations,
+            strings.values,
+            members,
+            member_offsets,
+            lines,
+            line_offsets,
+            version=version,
+        )
+
+    def _string_column(self, indexes):
+        strings = self.strings
+        return [strings[i] if i != NO_STRING else None for i in indexes.tolist()]
+
+    def _match(self, query, array, fields):
+        """いずれかの文字列列に大文字小文字を区別せず部分一致する行のマスク"""
+        query = query.lower()
+        # 末尾のFalseはNO_STRING（-1）の参照先になる
+        matched = np.fromiter(
+            (query in s for s in self._lowered),
+            dtype=bool,
+            count=len(self._lowered),
+        )
+        matched = np.append(matched, False)
+        mask = np.zeros(len(array), dtype=bool)
+        for field in fields:
+            mask |= matched[array[field]]
+        return mask
+
+    def star_rows_to_dicts(self, rows):
+        """starsの行番号から検索結果形式の辞書を作る"""
+        stars = self.stars[rows]
+        # 末尾の-1は所属なし（constellation == -1）の参照先になる
+        constellation_ids = np.append(self.constellations["id"], -1)[
+            stars["constellation"]
+        ]
+        return [
+            {
+                "id": star_id,
+                "name": name,
+                "name_jp": name_jp,
+                "bayer_designation": bayer,
+                "right_ascension": ra,
+                "declination": dec,
+                "magnitude": magnitude,
+                "constellation_id": constellation_id if constellation_id >= 0 else None,
+            }
+            for star_id, name, name_jp, bayer, ra, dec, magnitude, constellation_id in zip(
+                stars["id"].tolist(),
+                self._string_column(stars["name"]),
+                self._string_column(stars["name_jp"]),
+                self._string_column(stars["bayer_designation"]),
+                _float_column(stars["right_ascension"]),
+                _float_column(stars["declination"]),
+                _float_column(stars["magnitude"]),
+                constellation_ids.tolist(),
+            )
+        ]
+
+    def nearest_stars(
+        self, right_ascension, declination, limit=5, magnitude_limit=None
+    ):
+        """各方向に近い星を角距離（度）付きで返す"""
+        results = []
+        for rows, separations in self.star_index.query(
+            right_ascension, declination, limit, magnitude_limit
+        ):
+            stars = self.star_rows_to_dicts(rows)
+            for star, separation in zip(stars, separations.tolist()):
+                star["separation"] = separation
+            results.append(stars)
+        return results
+
+    def search_stars(self, query):
+        """名前・日本語名・バイエル符号で星を検索する"""
+        mask = self._match(query, self.stars, ("name", "name_jp", "bayer_designation"))
+        return self.star_rows_to_dicts(np.flatnonzero(mask))
+
+    def search_constellations(self, query):
+        """名前・日本語名・略符で星座を検索する"""
+        mask = self._match(
+            query, self.constellations, ("name", "name_jp", "abbreviation")
+        )
+        constellations = self.constellations[mask]
+        return [
+            {
+                "id": constellation_id,
+                "name": name,
+                "name_jp": name_jp,
+                "abbreviation": abbreviation,
+                "season": season,
+                "description": description,
+                "right_ascension_center": ra,
+                "declination_center": dec,
+            }
+            for constellation_id, name, name_jp, abbreviation, season, description, ra, dec in zip(
+                constellations["id"].tolist(),
+                self._string_column(constellations["name"]),
+                self._string_column(constellations["name_jp"]),
+                self._string_column(constellations["abbreviation"]),
+                self._string_column(constellations["season"]),
+                self._string_column(constellations["description"]),
+                _float_column(constellations["right_ascension_center"]),
+                _float_column(constellations["declination_center"]),
+            )
+        ]
+
+    def constellations_payload(self):
+        """/constellations のレスポンス形式で全星座を返す"""
+        stars = self.stars
+        names = self._string_column(stars["name"])
+        right_ascensions = _float_column(stars["right_ascension"])
+        declinations = _float_column(stars["declination"])
+        magnitudes = _float_column(stars["magnitude"])
+        # 星座ごとに分割したインデックス配列
+        member_groups = np.split(self.members, self.member_offsets[1:-1])
+        line_groups = np.split(self.lines, self.line_offsets[1:-1])
+
+        def star_point(row):
+            return {
+                "name": names[row],
+                "right_ascension": right_ascensions[row],
+                "declination": declinations[row],
+            }
+
+        result = []
+        constellations = self.constellations
+        for name, name_jp, description, ra, dec, members, lines in zip(
+            self._string_column(constellations["name"]),
+            self._string_column(constellations["name_jp"]),
+            self._string_column(constellations["description"]),
+            _float_column(constellations["right_ascension_center"]),
+            _float_column(constellations["declination_center"]),
+            member_groups,
+            line_groups,
+        ):
+            result.append(
+                {
+                    "name": name,
+                    "name_jp": name_jp,
+                    "description": description,
+                    "right_ascension_center": ra,
+                    "declination_center": dec,
+                    "stars": [
+                        {
+                            "name": names[row],
+                            "right_ascension": right_ascensions[row],
+                            "declination": declinations[row],
+                            "magnitude": magnitudes[row],
+                        }
+                        for row in members.tolist()
+                    ],
+                    "lines": [
+                        {"star1": star_point(star1), "star2": star_point(star2)}
+                        for star1, star2 in lines.tolist()
+                    ],
+                }
+            )
+        return result
+
+
+# ワーカー内で共有する現在のスナップショット
+_current_store = None
+
+
+def get_catalog_store():
+    """現在のスナップショットを返す（未ロードならNone）"""
+    return _current_store
+
+
+def set_catalog_store(store):
+    """スナップショットを差し替える（参照の代入なので読み取り側は常に一貫した状態を見る）"""
+    global _current_store
+    _current_store = store
+
+
+def read_catalog_version(db):
+    """
+    DB上の星表バージョンを返す（未設定ならNone）。
+    バージョン管理の導入前に作られたDBにはテーブルがないため、その場合もNoneとする。
+    """
+    if not inspect(db.connection()).has_table(CatalogVersion.__tablename__):
+        return None
+    return (
+        db.query(CatalogVersion.version)
+        .filter(CatalogVersion.id == CATALOG_VERSION_ID)
+        .scalar()
+    )
+
+
+def load_catalog_store(session_factory):
+    """
+    DBからストアを構築して現在のスナップショットに設定する。
+    読み込み中に毎回星表が更新され一貫した状態を得られなかった場合は
+    RuntimeErrorを送出し、現在のスナップショットはそのまま残す。
+    """
+    db = session_factory()
+    try:
+        for _ in range(_MAX_LOAD_ATTEMPTS):
+            version = read_catalog_version(db)
+            store = CatalogStore.from_session(db, version=version)
+            # 読み込みの途中で更新が入っていなければ一貫したスナップショット
+            if read_catalog_version(db) == version:
+                break
+            db.rollback()
+        else:
+            raise RuntimeError(
+                f"星表の読み込み中に更新が続いたため、{_MAX_LOAD_ATTEMPTS} 回試行しても"
+                "一貫したスナップショットを取得できませんでした"
+            )
+    finally:
+        db.close()
+    set_catalog_store(store)
+    return store
+
+
+def reload_catalog_store_if_changed(session_factory):
+    """星表バージョンが変わっていればストアを再構築して差し替える"""
+    current = get_catalog_store()
+    if current is not None:
+        db = session_factory()
+        try:
+            if read_catalog_version(db) == current.version:
+                return None
+        finally:
+            db.close()
+    return load_catalog_store(session_factory)
+
+
+async def watch_catalog_version(session_factory, interval):
+    """
+    一定間隔で星表バージョンを確認し、変更があればストアを差し替える。
+    再構築はスレッドで行い、イベントループをブロックしない。
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            store = await asyncio.to_thread(
+                reload_catalog_store_if_changed, session_factory
+            )
+        except Exception as e:
+            print(f"警告: 星表の再読み込みに失敗しました: {e}")
+            continue
+        if store is not None:
+            print(f"星表をバージョン {store.version} に更新しました。")
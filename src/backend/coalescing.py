@@ -0,0 +1,56 @@
+"""
+同一キーの同時リクエストをまとめるシングルフライト
+
+同じ正規化キーの計算が実行中であれば新たに計算せず、その結果を待って共有する。
+計算はスレッドで実行し、イベントループをブロックしない。
+"""
+
+import asyncio
+import math
+from datetime import timedelta
+
+
+class SingleFlight:
+    """実行中の計算をキーごとに1つに制限し、同時の呼び出しで結果を共有する"""
+
+    def __init__(self):
+        self._in_flight = {}
+        self.requests = 0  # 呼び出し回数
+        self.computations = 0  # 実際に計算した回数
+
+    async def run(self, key, func, *args):
+        """keyの計算が実行中ならその結果を待ち、なければfunc(*args)を実行する"""
+        self.requests += 1
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._compute(key, func, args))
+            self._in_flight[key] = future
+        # 待機側がキャンセルされても共有中の計算は継続させる
+        return await asyncio.shield(future)
+
+    async def _compute(self, key, func, args):
+        self.computations += 1
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self):
+        """計算を省略できた回数などの統計"""
+        return {
+            "requests": self.requests,
+            "computations": self.computations,
+            "coalesced": self.requests - self.computations,
+            "in_flight": len(self._in_flight),
+        }
+
+
+def quantize(value, step):
+    """値をstep刻みに丸めた整数インデックスを返す"""
+    return round(value / step)
+
+
+def time_bucket(dt, seconds):
+    """日時をseconds秒刻みのバケットの開始時刻に切り捨てる（タイムゾーンは保持）"""
+    offset = math.floor(dt.timestamp()) % seconds
+    return dt.replace(microsecond=0) - timedelta(seconds=offset)
@@ -0,0 +1,30 @@
+"""
+観測地点の地平座標の計算
+
+地心直交座標（地球固定座標）のベクトルを観測地点の東・北・天頂座標に回転し、
+高度・方位角に変換する。衛星のパス予測と星空画像のレンダリングで共通に使う。
+"""
+
+import numpy as np
+
+
+def enu_matrix(latitude, longitude):
+    """地心直交座標から観測地点の東・北・天頂方向への回転行列"""
+    lat = np.radians(latitude)
+    lon = np.radians(longitude)
+    return np.array(
+        [
+            [-np.sin(lon), np.cos(lon), 0.0],
+            [-np.sin(lat) * np.cos(lon), -np.sin(lat) * np.sin(lon), np.cos(lat)],
+            [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)],
+        ]
+    )
+
+
+def vectors_to_altaz(vectors, enu):
+    """観測地点からのベクトル (..., 3) を高度・方位角（度）に変換する"""
+    east, north, up = np.moveaxis(vectors @ enu.T, -1, 0)
+    distance = np.sqrt(east**2 + north**2 + up**2)
+    altitude = np.degrees(np.arcsin(up / distance))
+    azimuth = np.degrees(np.arctan2(east, north)) % 360
+    return altitude, azimuth
@@ -1,9 +1,18 @@
+import argparse
 import os
 import csv
+from datetime import datetime
 from dotenv import load_dotenv
 from sqlalchemy import text
 from database import engine, SessionLocal
-from models import Base, Star, Constellation, ConstellationLine
+from models import (
+    CATALOG_VERSION_ID,
+    Base,
+    CatalogVersion,
+    Star,
+    Constellation,
+    ConstellationLine,
+)
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
@@ -29,39 +38,33 @@ def clear_database(db):
     print("データのクリアが完了しました。")
 
 
-def _load_constellations(db):
-    """星座データをCSVから読み込み、DBに追加"""
+def _read_constellations():
+    """星座データをCSVから読み込む（略符 -> 列の値）"""
     print(f"{CONSTELLATIONS_CSV} から星座データを読み込んでいます...")
-    constellation_map = {}  # abbreviation -> id のマッピング用
+    constellations = {}
     with open(CONSTELLATIONS_CSV, mode="r", encoding="utf-8") as file:
         reader = csv.DictReader(file)
         for row in reader:
-            constellation = Constellation(
-                name=row["name"],
-                name_jp=row["name_jp"],
-                abbreviation=row["abbreviation"],
-                season=row["season"],
-                right_ascension_center=float(row["right_ascension_center"]),
-                declination_center=float(row["declination_center"]),
-                description=row["description"],
-            )
-            db.add(constellation)
-            db.flush()  # IDを取得するため
-            constellation_map[constellation.abbreviation] = constellation.id
-    db.commit()  # 星座データをコミット
-    print("星座データの追加が完了しました。")
-    return constellation_map
+            constellations[row["abbreviation"]] = {
+                "name": row["name"],
+                "name_jp": row["name_jp"],
+                "abbreviation": row["abbreviation"],
+                "season": row["season"],
+                "right_ascension_center": float(row["right_ascension_center"]),
+                "declination_center": float(row["declination_center"]),
+                "description": row["description"],
+            }
+    return constellations
 
 
-def _load_stars(db, constellation_map):
-    """星データをCSVから読み込み、DBに追加"""
+def _read_stars(constellations):
+    """星データをCSVから読み込む（hip_number -> 列の値と星座略符）"""
     print(f"{STARS_CSV} から星データを読み込んでいます...")
-    star_map = {}  # hip_number -> id のマッピング用
+    stars = {}
     with open(STARS_CSV, mode="r", encoding="utf-8") as file:
         reader = csv.DictReader(file)
         for row in reader:
-            constellation_id = constellation_map.get(row["constellation_abbreviation"])
-            if constellation_id is None:
+            if row["constellation_abbreviation"] not in constellations:
                 print(
                     f"警告: 星 '{row['name']}' の星座略符 '{row['constellation_abbreviation']}' が見つかりません。スキップします。"
                 )
@@ -82,64 +85,182 @@ def _load_stars(db, constellation_map):
                 )
                 continue
 
-            star = Star(
-                hip_number=hip_number,
-                name=row["name"],
-                common_name_jp=row.get("common_name_jp"),  # Optional
-                bayer_designation=row.get("bayer_designation"),  # Optional
-                right_ascension=float(row["right_ascension"]),
-                declination=float(row["declination"]),
-                magnitude=float(row["magnitude"]),
-                constellation_id=constellation_id,
+            stars[hip_number] = (
+                row["constellation_abbreviation"],
+                {
+                    "hip_number": hip_number,
+                    "name": row["name"],
+                    "common_name_jp": row.get("common_name_jp"),  # Optional
+                    "bayer_designation": row.get("bayer_designation"),  # Optional
+                    "right_ascension": float(row["right_ascension"]),
+                    "declination": float(row["declination"]),
+                    "magnitude": float(row["magnitude"]),
+                },
             )
-            db.add(star)
-            db.flush()  # IDを取得するため
-            star_map[star.hip_number] = star.id
-    db.commit()  # 星データをコミット
-    print("星データの追加が完了しました。")
-    return star_map
+    return stars
 
 
-def _load_constellation_lines(db, constellation_map, star_map):
-    """星座線データをCSVから読み込み、DBに追加"""
+def _read_constellation_lines(constellations, stars):
+    """星座線データをCSVから読み込む（(略符, 星1 HIP, 星2 HIP) のリスト）"""
     print(f"{CONSTELLATION_LINES_CSV} から星座線データを読み込んでいます...")
+    lines = []
     with open(CONSTELLATION_LINES_CSV, mode="r", encoding="utf-8") as file:
         reader = csv.DictReader(file)
-        lines_to_add = []
         for row in reader:
-            constellation_id = constellation_map.get(row["constellation_abbreviation"])
-            star1_id = star_map.get(int(row["star1_hip"]))
-            star2_id = star_map.get(int(row["star2_hip"]))
-
-            if constellation_id is None:
+            if row["constellation_abbreviation"] not in constellations:
                 print(
                     f"警告: 星座線データの星座略符 '{row['constellation_abbreviation']}' が見つかりません。スキップします。"
                 )
                 continue
-            if star1_id is None:
+            if int(row["star1_hip"]) not in stars:
                 print(
                     f"警告: 星座線データの星1 HIP '{row['star1_hip']}' が見つかりません。スキップします。"
                 )
                 continue
-            if star2_id is None:
+            if int(row["star2_hip"]) not in stars:
                 print(
                     f"警告: 星座線データの星2 HIP '{row['star2_hip']}' が見つかりません。スキップします。"
                 )
                 continue
+            lines.append(
+                (
+                    row["constellation_abbreviation"],
+                    int(row["star1_hip"]),
+                    int(row["star2_hip"]),
+                )
+            )
+    return lines
+
+
+def _sync_rows(db, model, key, desired, counts):
+    """
+    キー列で既存行とCSVの行を突き合わせ、差分だけ追加・更新する。
+    キー -> 行オブジェクトの辞書と、削除すべき既存行のリストを返す。
+    """
+    existing = {}
+    stale = []
+    for obj in db.query(model).order_by(model.id):
+        value = getattr(obj, key)
+        # CSVにないキー、キーなし、重複した行は削除対象
+        if value in desired and value not in existing:
+            existing[value] = obj
+        else:
+            stale.append(obj)
+
+    for value, columns in desired.items():
+        obj = existing.get(value)
+        if obj is None:
+            existing[value] = model(**columns)
+            db.add(existing[value])
+            counts["inserted"] += 1
+        elif any(getattr(obj, column) != v for column, v in columns.items()):
+            for column, v in columns.items():
+                setattr(obj, column, v)
+            counts["updated"] += 1
+    db.flush()  # 追加した行のIDを取得するため
+    return existing, stale
 
-            line = ConstellationLine(
-                constellation_id=constellation_id,
-                star1_id=star1_id,
-                star2_id=star2_id,
+
+def _sync_constellation_lines(db, lines, counts):
+    """星座線を (星座ID, 星1 ID, 星2 ID) で突き合わせ、差分だけ追加・削除する"""
+    desired = dict.fromkeys(lines)
+    existing = set()
+    for line in db.query(ConstellationLine).order_by(ConstellationLine.id):
+        key = (line.constellation_id, line.star1_id, line.star2_id)
+        if key in desired and key not in existing:
+            existing.add(key)
+        else:
+            db.delete(line)
+            counts["deleted"] += 1
+    for key in desired:
+        if key not in existing:
+            constellation_id, star1_id, star2_id = key
+            db.add(
+                ConstellationLine(
+                    constellation_id=constellation_id,
+                    star1_id=star1_id,
+                    star2_id=star2_id,
+                )
             )
-            lines_to_add.append(line)
-        db.add_all(lines_to_add)
-    db.commit()  # 星座線データをコミット
-    print("星座線データの追加が完了しました。")
+            counts["inserted"] += 1
+    db.flush()
+
+
+def _delete_rows(db, rows, counts):
+    for obj in rows:
+        db.delete(obj)
+        counts["deleted"] += 1
+    db.flush()
+
+
+def _bump_catalog_version(db):
+    """星表のバージョンを加算して新しいバージョンを返す"""
+    catalog_version = db.get(CatalogVersion, CATALOG_VERSION_ID)
+    if catalog_version is None:
+        catalog_version = CatalogVersion(id=CATALOG_VERSION_ID, version=0)
+        db.add(catalog_version)
+    catalog_version.version = (catalog_version.version or 0) + 1
+    catalog_version.updated_at = datetime.utcnow()
+    db.flush()
+    return catalog_version.version
 
 
-def init_database():
-    """データベースの初期化、テーブル作成、CSVからのデータ投入"""
+def update_database(db):
+    """
+    CSVの星表とDBの差分（追加・更新・削除）だけを1つのトランザクションで適用する。
+    星座は略符、星はhip_number、星座線は両端の星で突き合わせる。
+    変更があった場合は星表のバージョンを加算する。
+    """
+    constellations = _read_constellations()
+    stars = _read_stars(constellations)
+    lines = _read_constellation_lines(constellations, stars)
+
+    counts = {"inserted": 0, "updated": 0, "deleted": 0}
+    try:
+        constellation_objs, stale_constellations = _sync_rows(
+            db, Constellation, "abbreviation", constellations, counts
+        )
+        star_columns = {
+            hip_number: {
+                **columns,
+                "constellation_id": constellation_objs[abbreviation].id,
+            }
+            for hip_number, (abbreviation, columns) in stars.items()
+        }
+        star_objs, stale_stars = _sync_rows(
+            db, Star, "hip_number", star_columns, counts
+        )
+        _sync_constellation_lines(
+            db,
+            [
+                (
+                    constellation_objs[abbreviation].id,
+                    star_objs[hip1].id,
+                    star_objs[hip2].id,
+                )
+                for abbreviation, hip1, hip2 in lines
+            ],
+            counts,
+        )
+        # 参照元を先に片付けてから星、星座の順に削除する
+        _delete_rows(db, stale_stars, counts)
+        _delete_rows(db, stale_constellations, counts)
+
+        if any(counts.values()) or db.get(CatalogVersion, CATALOG_VERSION_ID) is None:
+            counts["version"] = _bump_catalog_version(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    print(
+        f"追加 {counts['inserted']} 件、更新 {counts['updated']} 件、削除 {counts['deleted']} 件を反映しました。"
+    )
+    return counts
+
+
+def init_database(reset=False):
+    """データベースの初期化、テーブル作成、CSVとの差分の反映"""
     print("データベースを初期化しています...")
     # テーブルが存在しない場合は作成
     Base.metadata.create_all(bind=engine)
@@ -148,27 +269,27 @@ def init_database():
     db = SessionLocal()
 
     try:
-        # 1. 既存データをクリア
-        clear_database(db)
+        # 明示的に指定された場合のみ既存データをクリア
+        if reset:
+            clear_database(db)
 
-        # 2. 星座データをロード
-        constellation_map = _load_constellations(db)
-
-        # 3. 星データをロード
-        star_map = _load_stars(db, constellation_map)
-
-        # 4. 星座線データをロード
-        _load_constellation_lines(db, constellation_map, star_map)
+        update_database(db)
 
         print("データベースの初期化とデータ投入が正常に完了しました。")
 
     except Exception as e:
         print(f"エラーが発生しました: {e}")
-        db.rollback()
         raise
     finally:
         db.close()
 
 
 if __name__ == "__main__":
-    init_database()
+    parser = argparse.ArgumentParser(description="CSVの星表をデータベースに反映する")
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="差分更新ではなく既存データをすべて削除してから投入する",
+    )
+    args = parser.parse_args()
+    init_database(reset=args.reset)
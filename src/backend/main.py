@@ -1,15 +1,26 @@
+import asyncio
 import os
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
-from sqlalchemy import or_
+
+import numpy as np
 
 from skyfield.api import load, wgs84
 
+from catalog_store import (
+    get_catalog_store,
+    load_catalog_store,
+    watch_catalog_version,
+)
+from coalescing import SingleFlight, quantize, time_bucket
 from database import SessionLocal
-from models import Constellation, Star
+from satellites import load_satellites, predict_passes
+from schemas import NearestStarsRequest, ObserverLocation, SkyPoint
+from sky_render import IMAGE_FORMATS, TileCache, render_sky
+from star_index import altaz_to_radec
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
@@ -46,6 +57,42 @@ ts = load.timescale()
 eph = load("de421.bsp")
 
 
+# 星表バージョンを確認する間隔（秒、0で無効）
+CATALOG_RELOAD_INTERVAL = float(os.getenv("CATALOG_RELOAD_INTERVAL", "30"))
+_catalog_watcher = None
+
+
+@app.on_event("startup")
+async def load_catalog():
+    """起動時に星表をDBから読み込み、インメモリストアを構築する"""
+    global _catalog_watcher
+    try:
+        load_catalog_store(SessionLocal)
+    except Exception as e:
+        # DBが未初期化でも起動は続行し、最初のリクエスト時に再読み込みする
+        print(f"警告: 星表の読み込みに失敗しました: {e}")
+
+    # 星表の更新を検知してホットリロードする
+    if CATALOG_RELOAD_INTERVAL > 0:
+        _catalog_watcher = asyncio.create_task(
+            watch_catalog_version(SessionLocal, CATALOG_RELOAD_INTERVAL)
+        )
+
+
+@app.on_event("shutdown")
+async def stop_catalog_watcher():
+    if _catalog_watcher is not None:
+        _catalog_watcher.cancel()
+
+
+def get_store():
+    """現在の星表ストアを返す（未ロードの場合はここで読み込む）"""
+    store = get_catalog_store()
+    if store is None:
+        store = load_catalog_store(SessionLocal)
+    return store
+
+
 @app.get("/search")
 async def search_celestial_objects(
     query: str = Query(..., description="検索キーワード"),
@@ -55,72 +102,22 @@ async def search_celestial_objects(
     星や星座を検索するエンドポイント
     """
     try:
-        db = SessionLocal()
+        store = get_store()
         results = {"stars": [], "constellations": []}
 
         # 検索タイプに基づいて検索を実行
         if type in [None, "all", "star"]:
             # 星の検索
-            stars = (
-                db.query(Star)
-                .filter(
-                    or_(
-                        Star.name.ilike(f"%{query}%"),
-                        Star.common_name_jp.ilike(f"%{query}%"),
-                        Star.bayer_designation.ilike(f"%{query}%"),
-                    )
-                )
-                .all()
-            )
-
-            for star in stars:
-                results["stars"].append(
-                    {
-                        "id": star.id,
-                        "name": star.name,
-                        "name_jp": star.common_name_jp,
-                        "bayer_designation": star.bayer_designation,
-                        "right_ascension": star.right_ascension,
-                        "declination": star.declination,
-                        "magnitude": star.magnitude,
-                        "constellation_id": star.constellation_id,
-                    }
-                )
+            results["stars"] = store.search_stars(query)
 
         if type in [None, "all", "constellation"]:
             # 星座の検索
-            constellations = (
-                db.query(Constellation)
-                .filter(
-                    or_(
-                        Constellation.name.ilike(f"%{query}%"),
-                        Constellation.name_jp.ilike(f"%{query}%"),
-                        Constellation.abbreviation.ilike(f"%{query}%"),
-                    )
-                )
-                .all()
-            )
-
-            for constellation in constellations:
-                results["constellations"].append(
-                    {
-                        "id": constellation.id,
-                        "name": constellation.name,
-                        "name_jp": constellation.name_jp,
-                        "abbreviation": constellation.abbreviation,
-                        "season": constellation.season,
-                        "description": constellation.description,
-                        "right_ascension_center": constellation.right_ascension_center,
-                        "declination_center": constellation.declination_center,
-                    }
-                )
+            results["constellations"] = store.search_constellations(query)
 
         return results
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
 
 
 @app.get("/")
@@ -128,6 +125,38 @@ async def read_root():
     return {"message": "星図表示アプリケーション API"}
 
 
+# 同時刻・同地点の /stars 計算をまとめる単位
+STARS_TIME_BUCKET_SECONDS = int(os.getenv("STARS_TIME_BUCKET_SECONDS", "60"))
+STARS_LOCATION_STEP = 0.01  # 緯度・経度（度）、約1km
+STARS_ALTITUDE_STEP = 100  # 高度（メートル）
+
+stars_flight = SingleFlight()
+
+
+def _compute_sun_position(latitude, longitude, altitude, dt):
+    """観測地点から見た太陽の高度・方位角を計算する"""
+    t = ts.from_datetime(dt)
+
+    # 観測地点の設定
+    location = wgs84.latlon(latitude, longitude, altitude)
+
+    # 基本的な天体を取得
+    sun = eph["sun"]
+    earth = eph["earth"]
+
+    # 観測地点からの位置を計算
+    observer = earth + location
+
+    # 太陽の位置を計算
+    sun_position = observer.at(t).observe(sun)
+    alt, az, _ = sun_position.apparent().altaz()
+
+    return {
+        "altitude": float(alt.degrees),
+        "azimuth": float(az.degrees),
+    }
+
+
 @app.get("/stars")
 async def get_stars(
     latitude: float,
@@ -142,21 +171,21 @@ async def get_stars(
         else:
             dt = datetime.now()
 
-        t = ts.from_datetime(dt)
-
-        # 観測地点の設定
-        location = wgs84.latlon(latitude, longitude, altitude)
-
-        # 基本的な天体を取得
-        sun = eph["sun"]
-        earth = eph["earth"]
-
-        # 観測地点からの位置を計算
-        observer = earth + location
-
-        # 太陽の位置を計算
-        sun_position = observer.at(t).observe(sun)
-        alt, az, _ = sun_position.apparent().altaz()
+        # 地点と時刻を正規化し、同じキーの同時リクエストは1回の計算を共有する
+        key = (
+            quantize(latitude, STARS_LOCATION_STEP),
+            quantize(longitude, STARS_LOCATION_STEP),
+            quantize(altitude, STARS_ALTITUDE_STEP),
+            time_bucket(dt, STARS_TIME_BUCKET_SECONDS),
+        )
+        sun_position = await stars_flight.run(
+            key,
+            _compute_sun_position,
+            key[0] * STARS_LOCATION_STEP,
+            key[1] * STARS_LOCATION_STEP,
+            key[2] * STARS_ALTITUDE_STEP,
+            key[3],
+        )
 
         # ここで星のデータを計算して返す
         # 実際のアプリケーションでは、より詳細な星のカタログを使用する
@@ -168,16 +197,325 @@ async def get_stars(
                 "altitude": altitude,
                 "datetime": dt.isoformat(),
             },
-            "sun_position": {
-                "altitude": float(alt.degrees),
-                "azimuth": float(az.degrees),
-            },
+            "sun_position": dict(sun_position),
         }
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# 一括検索で受け付ける方向の最大数
+MAX_NEAREST_POINTS = 10000
+
+
+def _resolve_sky_points(points, observer):
+    """方向のリストを赤経・赤緯（度）の配列に変換する"""
+    right_ascension = np.full(len(points), np.nan)
+    declination = np.full(len(points), np.nan)
+    altaz = []
+    for i, point in enumerate(points):
+        if point.right_ascension is not None and point.declination is not None:
+            right_ascension[i] = point.right_ascension
+            declination[i] = point.declination
+        elif point.target_altitude is not None and point.target_azimuth is not None:
+            altaz.append(i)
+        else:
+            raise ValueError(
+                "right_ascension と declination、または target_altitude と target_azimuth を指定してください"
+            )
+
+    if altaz:
+        if observer is None:
+            raise ValueError("高度・方位角で指定する場合は観測地点が必要です")
+        t = ts.from_datetime(observer.datetime or datetime.now(timezone.utc))
+        right_ascension[altaz], declination[altaz] = altaz_to_radec(
+            observer.latitude,
+            observer.longitude,
+            observer.altitude or 0,
+            t,
+            [points[i].target_altitude for i in altaz],
+            [points[i].target_azimuth for i in altaz],
+        )
+    return right_ascension, declination
+
+
+@app.get("/stars/nearest")
+async def get_nearest_stars(
+    right_ascension: Optional[float] = None,
+    declination: Optional[float] = None,
+    target_altitude: Optional[float] = None,
+    target_azimuth: Optional[float] = None,
+    latitude: Optional[float] = None,
+    longitude: Optional[float] = None,
+    altitude: Optional[float] = 0,
+    datetime_str: Optional[str] = None,
+    limit: int = Query(5, ge=1, le=100, description="最大件数"),
+    magnitude_limit: Optional[float] = Query(
+        None, description="この等級以下の星に限る"
+    ),
+):
+    """
+    指定した方向に最も近い星を返すエンドポイント（タップした星の同定用）
+    赤経・赤緯、または観測地点と日時を添えた高度・方位角で方向を指定する
+    """
+    try:
+        observer = None
+        if latitude is not None and longitude is not None:
+            observer = ObserverLocation(
+                latitude=latitude,
+                longitude=longitude,
+                altitude=altitude,
+                datetime=datetime.fromisoformat(datetime_str) if datetime_str else None,
+            )
+        point = SkyPoint(
+            right_ascension=right_ascension,
+            declination=declination,
+            target_altitude=target_altitude,
+            target_azimuth=target_azimuth,
+        )
+        ra, dec = _resolve_sky_points([point], observer)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 探索と辞書の構築はスレッドで行い、イベントループをブロックしない
+    results = await asyncio.to_thread(
+        get_store().nearest_stars, ra, dec, limit, magnitude_limit
+    )
+    stars = results[0]
+    return {
+        "right_ascension": float(ra[0]),
+        "declination": float(dec[0]),
+        "stars": stars,
+    }
+
+
+@app.post("/stars/nearest")
+async def get_nearest_stars_bulk(request: NearestStarsRequest):
+    """複数の方向について最も近い星をまとめて返すエンドポイント"""
+    try:
+        if len(request.points) > MAX_NEAREST_POINTS:
+            raise ValueError(f"points は {MAX_NEAREST_POINTS} 件までです")
+        ra, dec = _resolve_sky_points(request.points, request.observer)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    results = await asyncio.to_thread(
+        get_store().nearest_stars, ra, dec, request.limit, request.magnitude_limit
+    )
+    return {
+        "results": [
+            {"right_ascension": r, "declination": d, "stars": stars}
+            for r, d, stars in zip(ra.tolist(), dec.tolist(), results)
+        ]
+    }
+
+
+# TLEファイル（またはTLEファイルを置いたディレクトリ）のパス
+TLE_PATH = os.getenv(
+    "TLE_PATH", os.path.join(os.path.dirname(__file__), "data", "satellites")
+)
+
+satellites_flight = SingleFlight()
+
+
+def _compute_satellite_passes(
+    latitude, longitude, altitude, start, hours, step_seconds, min_altitude, name
+):
+    """TLEを読み込み、観測地点から見た衛星のパスを予測する"""
+    catalog = load_satellites(TLE_PATH)
+    if name:
+        catalog = catalog.select(name)
+    return predict_passes(
+        catalog,
+        latitude,
+        longitude,
+        altitude,
+        start,
+        hours=hours,
+        step_seconds=step_seconds,
+        min_altitude=min_altitude,
+        eph=eph,
+    )
+
+
+@app.get("/satellites/passes")
+async def get_satellite_passes(
+    latitude: float,
+    longitude: float,
+    altitude: Optional[float] = 0,
+    datetime_str: Optional[str] = None,
+    hours: float = Query(2, gt=0, le=24, description="予測する時間（時間）"),
+    step_seconds: int = Query(30, ge=1, le=600, description="計算の時間間隔（秒）"),
+    min_altitude: float = Query(10, ge=0, le=90, description="最低高度（度）"),
+    name: Optional[str] = Query(None, description="衛星名（部分一致）"),
+    visible_only: bool = Query(False, description="肉眼で見えるパスのみ"),
+):
+    """
+    ISSやStarlinkなど人工衛星のパスを予測するエンドポイント
+    """
+    try:
+        # 日時の処理
+        if datetime_str:
+            dt = datetime.fromisoformat(datetime_str)
+        else:
+            dt = datetime.now(timezone.utc)
+        if dt.tzinfo is None:
+            raise ValueError("タイムゾーン付きの日時を指定してください")
+
+        # 同じ地点・時間帯・条件の同時リクエストは1回の計算を共有する
+        key = (
+            quantize(latitude, STARS_LOCATION_STEP),
+            quantize(longitude, STARS_LOCATION_STEP),
+            quantize(altitude, STARS_ALTITUDE_STEP),
+            time_bucket(dt, STARS_TIME_BUCKET_SECONDS),
+            hours,
+            step_seconds,
+            min_altitude,
+            name,
+        )
+        passes = await satellites_flight.run(
+            key,
+            _compute_satellite_passes,
+            key[0] * STARS_LOCATION_STEP,
+            key[1] * STARS_LOCATION_STEP,
+            key[2] * STARS_ALTITUDE_STEP,
+            *key[3:],
+        )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if visible_only:
+        passes = [p for p in passes if p["visible"]]
+    return {"passes": passes}
+
+
+# 星空画像タイルの量子化の単位とキャッシュ容量
+SKY_RENDER_TIME_BUCKET_SECONDS = int(os.getenv("SKY_RENDER_TIME_BUCKET_SECONDS", "60"))
+SKY_RENDER_LOCATION_STEP = 0.1  # 緯度・経度（度）
+SKY_RENDER_ANGLE_STEP = 1.0  # 視線方向・視野（度）
+SKY_RENDER_MAGNITUDE_STEP = 0.5  # 限界等級
+SKY_TILE_CACHE_BYTES = int(os.getenv("SKY_TILE_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+sky_render_flight = SingleFlight()
+sky_tiles = TileCache(SKY_TILE_CACHE_BYTES)
+
+
+def _compute_sky_image(store, key):
+    """量子化したパラメータで星空画像をレンダリングする"""
+    (
+        _,
+        latitude,
+        longitude,
+        dt,
+        center_altitude,
+        center_azimuth,
+        fov,
+        width,
+        height,
+        magnitude_limit,
+        lines,
+        image_format,
+    ) = key
+    return render_sky(
+        store,
+        latitude * SKY_RENDER_LOCATION_STEP,
+        longitude * SKY_RENDER_LOCATION_STEP,
+        ts.from_datetime(dt),
+        center_altitude=center_altitude * SKY_RENDER_ANGLE_STEP,
+        center_azimuth=center_azimuth * SKY_RENDER_ANGLE_STEP,
+        fov=fov * SKY_RENDER_ANGLE_STEP,
+        width=width,
+        height=height,
+        magnitude_limit=magnitude_limit * SKY_RENDER_MAGNITUDE_STEP,
+        lines=lines,
+        image_format=image_format,
+    )
+
+
+@app.get("/sky/render")
+async def render_sky_image(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    datetime_str: Optional[str] = None,
+    center_altitude: float = Query(45, ge=-90, le=90, description="視線の高度（度）"),
+    center_azimuth: float = Query(180, description="視線の方位角（度）"),
+    fov: float = Query(90, ge=1, le=180, description="水平方向の視野（度）"),
+    width: int = Query(512, ge=64, le=2048),
+    height: int = Query(512, ge=64, le=2048),
+    magnitude_limit: float = Query(6.0, le=12, description="描画する限界等級"),
+    lines: bool = Query(True, description="星座線を描画する"),
+    format: str = Query("png", description="画像形式（png/webp）"),
+):
+    """
+    観測地点・日時・視野から見える星空を画像で返すエンドポイント（低性能な端末向け）
+    パラメータは量子化され、同じタイルは一度だけレンダリングしてキャッシュから返す
+    """
+    try:
+        # 日時の処理
+        if datetime_str:
+            dt = datetime.fromisoformat(datetime_str)
+        else:
+            dt = datetime.now(timezone.utc)
+        if dt.tzinfo is None:
+            raise ValueError("タイムゾーン付きの日時を指定してください")
+        image_format = format.lower()
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"format は {', '.join(IMAGE_FORMATS)} のいずれかです")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    store = get_store()
+    key = (
+        store.version,
+        quantize(latitude, SKY_RENDER_LOCATION_STEP),
+        quantize(longitude, SKY_RENDER_LOCATION_STEP),
+        time_bucket(dt, SKY_RENDER_TIME_BUCKET_SECONDS),
+        quantize(center_altitude, SKY_RENDER_ANGLE_STEP),
+        # 丸めてから一周分で割った余りを取り、359.6度と0度を同じキーにする
+        quantize(center_azimuth, SKY_RENDER_ANGLE_STEP)
+        % round(360 / SKY_RENDER_ANGLE_STEP),
+        quantize(fov, SKY_RENDER_ANGLE_STEP),
+        width,
+        height,
+        quantize(magnitude_limit, SKY_RENDER_MAGNITUDE_STEP),
+        lines,
+        image_format,
+    )
+
+    tile = sky_tiles.get(key)
+    cache_status = "hit"
+    if tile is None:
+        cache_status = "miss"
+        tile = await sky_render_flight.run(key, _compute_sky_image, store, key)
+        sky_tiles.put(key, tile)
+
+    return Response(
+        content=tile,
+        media_type=IMAGE_FORMATS[image_format],
+        headers={
+            "Cache-Control": f"public, max-age={SKY_RENDER_TIME_BUCKET_SECONDS}",
+            "X-Tile-Cache": cache_status,
+        },
+    )
+
+
+@app.get("/stats/sky-tiles")
+async def get_sky_tile_stats():
+    """星空画像タイルのキャッシュの統計を返す"""
+    return {"cache": sky_tiles.stats(), "render": sky_render_flight.stats()}
+
+
+@app.get("/stats/coalescing")
+async def get_coalescing_stats():
+    """同時リクエストの計算をまとめて省略できた回数を返す"""
+    return {
+        "stars": stars_flight.stats(),
+        "satellites": satellites_flight.stats(),
+    }
+
+
 @app.get("/constellations")
 async def get_constellations():
     """
@@ -185,62 +523,10 @@ async def get_constellations():
     実際のアプリケーションでは、完全な星座データを返す
     """
     try:
-        db = SessionLocal()
-        constellations = db.query(Constellation).all()
-
-        result = {"constellations": []}
-
-        for constellation in constellations:
-            stars_data = []
-            for star in constellation.stars:
-                stars_data.append(
-                    {
-                        "name": star.name,
-                        "right_ascension": star.right_ascension,
-                        "declination": star.declination,
-                        "magnitude": star.magnitude,
-                    }
-                )
-
-            # 星座線のデータを取得
-            lines_data = []
-            for line in constellation.lines:
-                star1 = db.query(Star).filter(Star.id == line.star1_id).first()
-                star2 = db.query(Star).filter(Star.id == line.star2_id).first()
-                if star1 and star2:
-                    lines_data.append(
-                        {
-                            "star1": {
-                                "name": star1.name,
-                                "right_ascension": star1.right_ascension,
-                                "declination": star1.declination,
-                            },
-                            "star2": {
-                                "name": star2.name,
-                                "right_ascension": star2.right_ascension,
-                                "declination": star2.declination,
-                            },
-                        }
-                    )
-
-            result["constellations"].append(
-                {
-                    "name": constellation.name,
-                    "name_jp": constellation.name_jp,
-                    "description": constellation.description,
-                    "right_ascension_center": constellation.right_ascension_center,
-                    "declination_center": constellation.declination_center,
-                    "stars": stars_data,
-                    "lines": lines_data,
-                }
-            )
-
-        return result
+        return {"constellations": get_store().constellations_payload()}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
 
 
 if __name__ == "__main__":
@@ -50,6 +50,19 @@ class ConstellationLine(Base):
     constellation = relationship("Constellation", back_populates="lines")
 
 
+# 星表バージョンを保持する行のID
+CATALOG_VERSION_ID = 1
+
+
+# 星表のバージョン（星表を更新するたびに加算し、APIワーカーが再読み込みの契機にする）
+class CatalogVersion(Base):
+    __tablename__ = "catalog_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
 # ユーザー設定モデル
 class UserSetting(Base):
     __tablename__ = "user_settings"
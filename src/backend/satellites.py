@@ -0,0 +1,242 @@
+"""
+人工衛星の可視パス予測
+
+ローカルのTLEファイル（またはTLEファイルを置いたディレクトリ）から衛星を読み込み、
+sgp4のSatrecArrayで全衛星・全時刻をまとめて伝搬して、観測地点から見える
+パス（出・最高点・入り）を求める。読み込んだ衛星はファイルの更新時刻と
+サイズで管理し、ファイルが変わったときだけ解析し直す。
+"""
+
+import os
+from datetime import timedelta
+
+import numpy as np
+from sgp4.api import SatrecArray
+from skyfield.api import load, wgs84
+from skyfield.framelib import itrs
+from skyfield.iokit import parse_tle_file
+from skyfield.sgp4lib import theta_GMST1982
+
+from horizon import enu_matrix, vectors_to_altaz
+
+# ディレクトリ指定時に読み込むTLEファイルの拡張子
+TLE_EXTENSIONS = (".tle", ".txt")
+
+# 1回の予測で計算する時刻の数の上限（24時間を30秒間隔で計算できる程度）
+MAX_TIME_STEPS = 2880
+
+# 一度に伝搬する衛星数×時刻数の上限（位置の配列は1要素24バイトなので約24MB）
+PROPAGATION_BUDGET = 1_000_000
+
+EARTH_RADIUS_KM = 6378.137
+
+# 観測地点の太陽高度がこれ以下なら空が暗いとみなす（市民薄明）
+TWILIGHT_SUN_ALTITUDE = -6.0
+
+ts = load.timescale()
+
+# ファイルパス -> ((更新時刻, サイズ), [(名前, Satrec), ...])
+_parsed_files = {}
+# ファイル構成 -> SatelliteCatalog
+_catalog_cache = {}
+
+
+class SatelliteCatalog:
+    """読み込んだ衛星の名前・衛星番号とSatrecArray"""
+
+    def __init__(self, satellites):
+        self.names = [name for name, _ in satellites]
+        self.satrecs = [satrec for _, satrec in satellites]
+        self.catalog_numbers = np.array(
+            [satrec.satnum for satrec in self.satrecs], dtype=np.int64
+        )
+
+    def __len__(self):
+        return len(self.satrecs)
+
+    def select(self, name):
+        """名前に部分一致する衛星だけのカタログを返す（大文字小文字を区別しない）"""
+        name = name.lower()
+        return SatelliteCatalog(
+            [
+                (n, satrec)
+                for n, satrec in zip(self.names, self.satrecs)
+                if name in (n or "").lower()
+            ]
+        )
+
+
+def _tle_files(path):
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.lower().endswith(TLE_EXTENSIONS)
+        )
+    if os.path.isfile(path):
+        return [path]
+    raise FileNotFoundError(f"TLEファイルが見つかりません: {path}")
+
+
+def _parse_file(path):
+    """TLEファイルを解析する（更新されていなければキャッシュを返す）"""
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _parsed_files.get(path)
+    if cached is not None and cached[0] == signature:
+        return signature, cached[1]
+
+    with open(path, "rb") as file:
+        satellites = [
+            (satellite.name, satellite.model) for satellite in parse_tle_file(file, ts)
+        ]
+    _parsed_files[path] = (signature, satellites)
+    return signature, satellites
+
+
+def load_satellites(path):
+    """TLEファイルまたはディレクトリから衛星カタログを読み込む"""
+    parsed = [(file, *_parse_file(file)) for file in _tle_files(path)]
+    key = tuple((file, signature) for file, signature, _ in parsed)
+    catalog = _catalog_cache.get(key)
+    if catalog is None:
+        _catalog_cache.clear()
+        catalog = SatelliteCatalog(
+            [satellite for _, _, satellites in parsed for satellite in satellites]
+        )
+        _catalog_cache[key] = catalog
+    return catalog
+
+
+def _julian_dates(times):
+    """UTCの日時のリストをsgp4用のユリウス日（整数部・小数部）に変換する"""
+    seconds = np.array([t.timestamp() for t in times])
+    jd = 2440587.5 + seconds / 86400.0
+    whole = np.floor(jd)
+    return whole, jd - whole
+
+
+def _propagate_itrf(satrec_array, jd, fr, theta):
+    """衛星群を全時刻まとめて伝搬し、地球固定座標（km）の位置 (衛星, 時刻, 3) を返す"""
+    errors, positions, _ = satrec_array.sgp4(jd, fr)
+    # TEMEからグリニッジ平均恒星時の分だけ回転して地球固定座標にする
+    cos_theta = np.cos(theta)
+    sin_theta = np.sin(theta)
+    x = positions[..., 0] * cos_theta + positions[..., 1] * sin_theta
+    y = -positions[..., 0] * sin_theta + positions[..., 1] * cos_theta
+    itrf = np.stack([x, y, positions[..., 2]], axis=-1)
+    itrf[errors != 0] = np.nan
+    return itrf
+
+
+def _sunlit(itrf, sun_direction):
+    """円柱影モデルで衛星が太陽に照らされているかを判定する"""
+    along = np.einsum("stk,tk->st", itrf, sun_direction)
+    perpendicular = itrf - along[..., np.newaxis] * sun_direction
+    return (along > 0) | (np.linalg.norm(perpendicular, axis=-1) > EARTH_RADIUS_KM)
+
+
+def _sun_geometry(eph, t, location, enu):
+    """各時刻の太陽方向（地球固定座標の単位ベクトル）と観測地点の太陽高度"""
+    sun = eph["earth"].at(t).observe(eph["sun"])
+    sun_itrf = np.asarray(sun.frame_xyz(itrs).km).T
+    sun_direction = sun_itrf / np.linalg.norm(sun_itrf, axis=-1, keepdims=True)
+    sun_altitude, _ = vectors_to_altaz(sun_itrf - location, enu)
+    return sun_direction, sun_altitude
+
+
+def _passes(altitude, min_altitude):
+    """高度の配列 (衛星, 時刻) から地平線上にある区間 (衛星, 開始, 終了) を求める"""
+    above = np.nan_to_num(altitude, nan=-90.0) >= min_altitude
+    padded = np.pad(above.astype(np.int8), ((0, 0), (1, 1)))
+    edges = np.diff(padded, axis=1)
+    starts = np.argwhere(edges == 1)
+    ends = np.argwhere(edges == -1)
+    # 行優先で並ぶので開始と終了は同じ順番で対応する
+    return starts[:, 0], starts[:, 1], ends[:, 1] - 1
+
+
+def predict_passes(
+    catalog,
+    latitude,
+    longitude,
+    altitude,
+    start,
+    hours=2.0,
+    step_seconds=30,
+    min_altitude=10.0,
+    eph=None,
+):
+    """
+    観測地点から見た衛星のパスを予測する。
+    ephを渡した場合は、衛星が日照中かつ空が暗い時刻を含むパスをvisibleとする。
+    予測期間の開始時にすでに出ている、または終了時にまだ沈んでいないパスは
+    truncatedとし、分からない出・入りをNoneにする（最高点は期間内での最高点）。
+    時刻の数がMAX_TIME_STEPSを超える場合はValueErrorを送出する。
+    """
+    if hours * 3600 / step_seconds > MAX_TIME_STEPS:
+        raise ValueError(
+            f"時刻の数が多すぎます（hours×3600/step_secondsは{MAX_TIME_STEPS}以下）"
+        )
+    times = [
+        start + timedelta(seconds=float(offset))
+        for offset in np.arange(0, hours * 3600 + step_seconds, step_seconds)
+    ]
+    jd, fr = _julian_dates(times)
+    theta, _ = theta_GMST1982(jd, fr)
+    location = np.asarray(wgs84.latlon(latitude, longitude, altitude).itrs_xyz.km)
+    enu = enu_matrix(latitude, longitude)
+
+    sun_direction = dark = None
+    if eph is not None:
+        sun_direction, sun_altitude = _sun_geometry(
+            eph, ts.from_datetimes(times), location, enu
+        )
+        dark = sun_altitude <= TWILIGHT_SUN_ALTITUDE
+
+    # 衛星数×時刻数が一定以下になるように衛星を分けて伝搬する
+    chunk_size = max(1, PROPAGATION_BUDGET // len(times))
+    passes = []
+    for offset in range(0, len(catalog), chunk_size):
+        stop = offset + chunk_size
+        satrec_array = SatrecArray(catalog.satrecs[offset:stop])
+        itrf = _propagate_itrf(satrec_array, jd, fr, theta)
+        sat_altitude, sat_azimuth = vectors_to_altaz(itrf - location, enu)
+        visible = None
+        if eph is not None:
+            visible = _sunlit(itrf, sun_direction) & dark
+
+        for sat, begin, end in zip(*_passes(sat_altitude, min_altitude)):
+            window = slice(begin, end + 1)
+            peak = begin + int(np.argmax(sat_altitude[sat, window]))
+            index = offset + sat
+            # 予測期間の開始時・終了時に見えているパスは出・入りが分からない
+            rise = set_ = None
+            if begin > 0:
+                rise = _event(times, sat_altitude, sat_azimuth, sat, begin)
+            if end < len(times) - 1:
+                set_ = _event(times, sat_altitude, sat_azimuth, sat, end)
+            entry = {
+                "name": catalog.names[index],
+                "catalog_number": int(catalog.catalog_numbers[index]),
+                "rise": rise,
+                "culmination": _event(times, sat_altitude, sat_azimuth, sat, peak),
+                "set": set_,
+                "truncated": rise is None or set_ is None,
+                "visible": (
+                    None if visible is None else bool(visible[sat, window].any())
+                ),
+            }
+            passes.append((begin, entry))
+
+    # 期間内で最初に見えた時刻の順に並べる
+    passes.sort(key=lambda item: item[0])
+    return [p for _, p in passes]
+
+
+def _event(times, altitude, azimuth, sat, index):
+    return {
+        "datetime": times[index].isoformat(),
+        "altitude": float(altitude[sat, index]),
+        "azimuth": float(azimuth[sat, index]),
+    }
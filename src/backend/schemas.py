@@ -2,6 +2,9 @@ from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 
+# ObserverLocation のフィールド名 datetime が型名を隠すため別名で参照する
+DateTime = datetime
+
 
 # スター関連のスキーマ
 class StarBase(BaseModel):
@@ -84,7 +87,26 @@ class ObserverLocation(BaseModel):
     latitude: float = Field(..., ge=-90, le=90, description="緯度")
     longitude: float = Field(..., ge=-180, le=180, description="経度")
     altitude: Optional[float] = Field(0, description="高度（メートル）")
-    datetime: Optional[datetime] = None
+    datetime: Optional[DateTime] = None
+
+
+# 最近傍の星の検索関連のスキーマ
+class SkyPoint(BaseModel):
+    """赤経・赤緯、または観測地点から見た高度・方位角で指定する方向"""
+
+    right_ascension: Optional[float] = Field(None, description="赤経（度）")
+    declination: Optional[float] = Field(None, ge=-90, le=90, description="赤緯（度）")
+    target_altitude: Optional[float] = Field(
+        None, ge=-90, le=90, description="高度（度）"
+    )
+    target_azimuth: Optional[float] = Field(None, description="方位角（度）")
+
+
+class NearestStarsRequest(BaseModel):
+    points: List[SkyPoint]
+    observer: Optional[ObserverLocation] = None  # 高度・方位角で指定する場合に必須
+    limit: int = Field(5, ge=1, le=100, description="1方向あたりの最大件数")
+    magnitude_limit: Optional[float] = Field(None, description="この等級以下の星に限る")
 
 
 # 天体位置関連のスキーマ
@@ -0,0 +1,181 @@
+"""
+サーバー側での星空画像のレンダリング
+
+観測地点・日時・視野から見える星空をステレオ投影で画像にする。星は等級に応じた
+明るさと大きさでNumPyによりガウス状に描き込み、星座線は星表の星座線から描く。
+低性能な端末向けに、量子化したパラメータをキーとするタイルキャッシュを通して返す。
+"""
+
+import io
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageDraw
+from skyfield.framelib import itrs
+
+from horizon import enu_matrix
+
+# 対応する画像形式とContent-Type
+IMAGE_FORMATS = {"png": "image/png", "webp": "image/webp"}
+
+BACKGROUND_COLOR = np.array([0.02, 0.03, 0.09])  # 夜空
+GROUND_COLOR = np.array([0.03, 0.05, 0.03])  # 地平線より下
+LINE_COLOR = (70, 110, 170)  # 星座線
+
+# 星の描き込みに使うカーネルの半径（ピクセル）
+SPLAT_RADIUS = 3
+
+
+def _view_basis(center_altitude, center_azimuth):
+    """視線方向・右方向・上方向の単位ベクトル（東・北・天頂座標）"""
+    alt = np.radians(center_altitude)
+    az = np.radians(center_azimuth)
+    forward = np.array(
+        [np.cos(alt) * np.sin(az), np.cos(alt) * np.cos(az), np.sin(alt)]
+    )
+    right = np.array([np.cos(az), -np.sin(az), 0.0])
+    up = np.cross(right, forward)
+    return forward, right, up
+
+
+def _project(enu, basis, scale, width, height):
+    """東・北・天頂座標の単位ベクトルをステレオ投影で画像座標に変換する"""
+    forward, right, up = basis
+    depth = enu @ forward
+    k = 2.0 / (1.0 + np.maximum(depth, -0.99))
+    columns = width / 2 + k * (enu @ right) * scale
+    rows = height / 2 - k * (enu @ up) * scale
+    return columns, rows, depth
+
+
+def _background(basis, scale, width, height):
+    """画素ごとに地平線の上下を判定して背景を塗る"""
+    forward, right, up = basis
+    x = (np.arange(width) + 0.5 - width / 2) / scale
+    y = (height / 2 - np.arange(height) - 0.5) / scale
+    x, y = np.meshgrid(x, y)
+    # ステレオ投影の逆変換で画素の方向の天頂成分を求める
+    rho2 = x**2 + y**2
+    z = (4 - rho2) / (4 + rho2)
+    k = (1 + z) / 2
+    zenith = k * x * right[2] + k * y * up[2] + z * forward[2]
+    image = np.empty((height, width, 3))
+    image[:] = BACKGROUND_COLOR
+    image[zenith < 0] = GROUND_COLOR
+    return image
+
+
+def _splat_stars(image, columns, rows, magnitudes, magnitude_limit):
+    """等級に応じた明るさと広がりで星を画像に加算する"""
+    height, width, _ = image.shape
+    brightness = np.clip(10 ** (-0.4 * (magnitudes - 1.0)), 0.15, 4.0)
+    sigma = 0.5 + 0.25 * np.clip(magnitude_limit - magnitudes, 0, 6)
+    base_columns = np.round(columns).astype(np.int64)
+    base_rows = np.round(rows).astype(np.int64)
+
+    flux = np.zeros((height, width))
+    for dy in range(-SPLAT_RADIUS, SPLAT_RADIUS + 1):
+        for dx in range(-SPLAT_RADIUS, SPLAT_RADIUS + 1):
+            c = base_columns + dx
+            r = base_rows + dy
+            inside = (c >= 0) & (c < width) & (r >= 0) & (r < height)
+            distance2 = (c - columns) ** 2 + (r - rows) ** 2
+            weight = brightness * np.exp(-distance2 / (2 * sigma**2))
+            np.add.at(flux, (r[inside], c[inside]), weight[inside])
+    image += np.clip(flux, 0, 1)[..., np.newaxis]
+    return np.clip(image, 0, 1)
+
+
+def render_sky(
+    store,
+    latitude,
+    longitude,
+    t,
+    center_altitude=45.0,
+    center_azimuth=180.0,
+    fov=90.0,
+    width=512,
+    height=512,
+    magnitude_limit=6.0,
+    lines=True,
+    image_format="png",
+):
+    """観測地点から見た星空をレンダリングして画像のバイト列を返す"""
+    index = store.star_index
+    # 星の方向（ICRS）を地球固定座標、さらに観測地点の東・北・天頂座標へ回転する
+    rotation = enu_matrix(latitude, longitude) @ itrs.rotation_at(t)
+    enu = index.vectors @ rotation.T
+
+    basis = _view_basis(center_altitude, center_azimuth)
+    scale = (width / 2) / (2 * np.tan(np.radians(fov) / 4))
+    columns, rows, depth = _project(enu, basis, scale, width, height)
+    above = (enu[:, 2] > 0) & (depth > 0)
+
+    image = _background(basis, scale, width, height)
+    bright = above & (index.magnitudes <= magnitude_limit)
+    image = _splat_stars(
+        image,
+        columns[bright],
+        rows[bright],
+        index.magnitudes[bright],
+        magnitude_limit,
+    )
+    picture = Image.fromarray((image * 255).astype(np.uint8), "RGB")
+
+    if lines and len(store.lines):
+        # starsの行番号からインデックス内の位置への対応
+        position = np.full(len(store.stars), -1)
+        position[index.rows] = np.arange(len(index.rows))
+        ends = position[store.lines]
+        visible = (ends >= 0).all(axis=1)
+        ends = ends[visible]
+        visible = above[ends].all(axis=1)
+        draw = ImageDraw.Draw(picture)
+        for star1, star2 in ends[visible].tolist():
+            draw.line(
+                [(columns[star1], rows[star1]), (columns[star2], rows[star2])],
+                fill=LINE_COLOR,
+                width=1,
+            )
+
+    output = io.BytesIO()
+    picture.save(output, format=image_format.upper())
+    return output.getvalue()
+
+
+class TileCache:
+    """描画済み画像を保持する容量上限付きのLRUキャッシュ"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._tiles = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        tile = self._tiles.get(key)
+        if tile is None:
+            self.misses += 1
+            return None
+        self._tiles.move_to_end(key)
+        self.hits += 1
+        return tile
+
+    def put(self, key, tile):
+        if key in self._tiles:
+            self._bytes -= len(self._tiles.pop(key))
+        self._tiles[key] = tile
+        self._bytes += len(tile)
+        # 上限を超えたら古いものから捨てる
+        while self._bytes > self.max_bytes and len(self._tiles) > 1:
+            _, evicted = self._tiles.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def stats(self):
+        return {
+            "tiles": len(self._tiles),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
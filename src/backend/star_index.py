@@ -0,0 +1,136 @@
+"""
+星の最近傍検索インデックス
+
+星の方向を単位ベクトルにしてKD木を構築し、指定した方向に近い星を
+角距離の近い順に返す。星表の読み込み時に一度だけ構築し、星表が
+更新されるとスナップショットごと作り直される。
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+from skyfield.api import wgs84
+
+# 等級順に並べた星を分けるブロックの数の上限と最小の大きさ
+# （ブロックに収まらない末尾は総当たりで探索する）
+_MAX_BLOCKS = 32
+_MIN_BLOCK_SIZE = 4096
+
+# 一度に処理する方向の数（総当たり部分のメモリ使用量を抑える）
+_QUERY_CHUNK_SIZE = 256
+
+
+def radec_to_vectors(right_ascension, declination):
+    """赤経・赤緯（度）を単位ベクトルの配列 (n, 3) に変換する"""
+    ra = np.radians(np.asarray(right_ascension, dtype=float))
+    dec = np.radians(np.asarray(declination, dtype=float))
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def chord_to_degrees(chord):
+    """単位球上の弦の長さを角距離（度）に変換する"""
+    return np.degrees(2 * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1)))
+
+
+def altaz_to_radec(latitude, longitude, altitude, t, target_altitude, target_azimuth):
+    """観測地点から見た高度・方位角（度）を赤経・赤緯（度、ICRS）に変換する"""
+    location = wgs84.latlon(latitude, longitude, altitude)
+    position = location.at(t).from_altaz(
+        alt_degrees=np.asarray(target_altitude, dtype=float),
+        az_degrees=np.asarray(target_azimuth, dtype=float),
+    )
+    ra, dec, _ = position.radec()
+    # 赤経は時角単位なので、skyfield 1.46でも使える時間から度に換算する
+    return ra.hours * 15, dec.degrees
+
+
+class StarIndex:
+    """
+    星の単位ベクトルに対するKD木
+
+    星を等級順（明るい順）に並べておくと、限界等級以下の星は配列の先頭部分になる。
+    配列を重ならない同じ大きさのブロックに分けてブロックごとにKD木を作り、先頭部分に
+    含まれるブロックのKD木をlimit件ずつ問い合わせ、残りの星は総当たりで調べて併合する。
+    限界等級に関わらず探索数はlimitのままで、KD木の合計の大きさは星の数の2倍で済む。
+    """
+
+    def __init__(self, stars):
+        # 座標が欠けている星はインデックスに含めない
+        valid = np.isfinite(stars["right_ascension"]) & np.isfinite(
+            stars["declination"]
+        )
+        rows = np.flatnonzero(valid)
+        order = np.argsort(stars["magnitude"][rows], kind="stable")
+        # 以下の配列は等級順に並んだ同じ星を指す
+        self.rows = rows[order]
+        self.magnitudes = stars["magnitude"][self.rows]
+        self.vectors = radec_to_vectors(
+            stars["right_ascension"][self.rows], stars["declination"][self.rows]
+        )
+        self.tree = cKDTree(self.vectors)
+
+        self._block_size = max(_MIN_BLOCK_SIZE, -(-len(self.rows) // _MAX_BLOCKS))
+        self._block_trees = []
+        for start in range(0, len(self.rows) - self._block_size + 1, self._block_size):
+            stop = start + self._block_size
+            self._block_trees.append(cKDTree(self.vectors[start:stop]))
+
+    def _query_chunk(self, vectors, count, limit):
+        """先頭count件の星から各方向に近いlimit件を探す"""
+        if count == len(self.rows):
+            blocks, tail = [(0, self.tree)], count
+        else:
+            full = count // self._block_size
+            blocks = [
+                (i * self._block_size, tree)
+                for i, tree in enumerate(self._block_trees[:full])
+            ]
+            tail = full * self._block_size
+
+        chords = []
+        indexes = []
+        for start, tree in blocks:
+            k = min(limit, tree.n)
+            chord, index = tree.query(vectors, k=k)
+            chords.append(np.asarray(chord).reshape(len(vectors), k))
+            indexes.append(np.asarray(index).reshape(len(vectors), k) + start)
+        if tail < count:
+            # ブロックに収まらない末尾の星は総当たりで距離を求める
+            # （内積の大きい順にlimit件だけ候補に残す）
+            dots = vectors @ self.vectors[tail:count].T
+            k = min(limit, count - tail)
+            index = np.argpartition(dots, -k, axis=1)[:, -k:]
+            dots = np.take_along_axis(dots, index, axis=1)
+            chords.append(np.sqrt(np.maximum(2 - 2 * dots, 0)))
+            indexes.append(index + tail)
+
+        chords = np.concatenate(chords, axis=1)
+        indexes = np.concatenate(indexes, axis=1)
+        nearest = np.argsort(chords, axis=1, kind="stable")[:, :limit]
+        return (
+            np.take_along_axis(indexes, nearest, axis=1),
+            np.take_along_axis(chords, nearest, axis=1),
+        )
+
+    def query(self, right_ascension, declination, limit=5, magnitude_limit=None):
+        """
+        各方向に近い星をlimit個まで返す。
+        magnitude_limitを指定した場合はそれ以下の等級（より明るい）の星に限る。
+        戻り値は (starsの行番号, 角距離（度）) のリストを方向ごとに並べたもの。
+        """
+        vectors = radec_to_vectors(
+            np.atleast_1d(right_ascension), np.atleast_1d(declination)
+        )
+        count = len(self.rows)
+        if magnitude_limit is not None:
+            count = int(np.searchsorted(self.magnitudes, magnitude_limit, "right"))
+        if count == 0:
+            empty = (np.empty(0, dtype=self.rows.dtype), np.empty(0))
+            return [empty] * len(vectors)
+
+        results = []
+        for start in range(0, len(vectors), _QUERY_CHUNK_SIZE):
+            stop = start + _QUERY_CHUNK_SIZE
+            indexes, chords = self._query_chunk(vectors[start:stop], count, limit)
+            results.extend(zip(self.rows[indexes], chord_to_degrees(chords)))
+        return results
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# テストからバックエンドのモジュールをインポートできるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from init_db import update_database  # noqa: E402
+from models import Base  # noqa: E402
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """CSVの星表を投入した一時SQLiteデータベースのセッションファクトリ"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'starmap.db'}")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = factory()
+    try:
+        update_database(db)
+    finally:
+        db.close()
+    yield factory
+    engine.dispose()
@@ -0,0 +1,96 @@
+import json
+
+from catalog_store import CatalogStore
+from models import Constellation, Star
+
+
+def _orm_constellations(db):
+    """従来のORM実装による /constellations の結果"""
+    result = []
+    for constellation in db.query(Constellation).order_by(Constellation.id).all():
+        lines = []
+        for line in constellation.lines:
+            star1 = db.get(Star, line.star1_id)
+            star2 = db.get(Star, line.star2_id)
+            lines.append(
+                {
+                    "star1": {
+                        "name": star1.name,
+                        "right_ascension": star1.right_ascension,
+                        "declination": star1.declination,
+                    },
+                    "star2": {
+                        "name": star2.name,
+                        "right_ascension": star2.right_ascension,
+                        "declination": star2.declination,
+                    },
+                }
+            )
+        result.append(
+            {
+                "name": constellation.name,
+                "name_jp": constellation.name_jp,
+                "description": constellation.description,
+                "right_ascension_center": constellation.right_ascension_center,
+                "declination_center": constellation.declination_center,
+                "stars": [
+                    {
+                        "name": star.name,
+                        "right_ascension": star.right_ascension,
+                        "declination": star.declination,
+                        "magnitude": star.magnitude,
+                    }
+                    for star in sorted(constellation.stars, key=lambda s: s.id)
+                ],
+                "lines": lines,
+            }
+        )
+    return result
+
+
+def test_constellations_payload_matches_orm(session_factory):
+    db = session_factory()
+    try:
+        store = CatalogStore.from_session(db)
+        assert store.constellations_payload() == _orm_constellations(db)
+    finally:
+        db.close()
+
+
+def test_search_is_case_insensitive_substring(session_factory):
+    db = session_factory()
+    try:
+        store = CatalogStore.from_session(db)
+        betelgeuse = db.query(Star).filter(Star.name == "Betelgeuse").one()
+    finally:
+        db.close()
+
+    stars = store.search_stars("betel")
+    assert [star["name"] for star in stars] == ["Betelgeuse"]
+    assert stars[0]["id"] == betelgeuse.id
+    assert stars[0]["constellation_id"] == betelgeuse.constellation_id
+    assert store.search_stars("ベテル")[0]["name"] == "Betelgeuse"
+    assert [c["abbreviation"] for c in store.search_constellations("ori")] == ["Ori"]
+    assert store.search_stars("no such star") == []
+
+
+def test_null_floats_are_returned_as_none(session_factory):
+    db = session_factory()
+    try:
+        betelgeuse = db.query(Star).filter(Star.name == "Betelgeuse").one()
+        betelgeuse.magnitude = None
+        orion = betelgeuse.constellation
+        orion.right_ascension_center = None
+        db.commit()
+        store = CatalogStore.from_session(db)
+        expected = _orm_constellations(db)
+    finally:
+        db.close()
+
+    assert store.search_stars("betelgeuse")[0]["magnitude"] is None
+    assert store.search_constellations("ori")[0]["right_ascension_center"] is None
+    payload = store.constellations_payload()
+    assert payload == expected
+    # NaNを含まず、そのままJSONにできる
+    json.dumps(payload, allow_nan=False)
+    json.dumps(store.search_stars("betelgeuse"), allow_nan=False)
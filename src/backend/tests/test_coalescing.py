@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from coalescing import SingleFlight, quantize, time_bucket
+
+
+def test_concurrent_calls_share_one_computation():
+    calls = []
+
+    def compute(value):
+        calls.append(threading.get_ident())
+        time.sleep(0.05)
+        return {"value": value}
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(
+            *(flight.run("key", compute, 1) for _ in range(10))
+        )
+        return flight, results
+
+    flight, results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {
+        "requests": 10,
+        "computations": 1,
+        "coalesced": 9,
+        "in_flight": 0,
+    }
+
+
+def test_different_keys_and_sequential_calls_compute_separately():
+    async def main():
+        flight = SingleFlight()
+        await asyncio.gather(flight.run("a", lambda: 1), flight.run("b", lambda: 2))
+        await flight.run("a", lambda: 1)
+        return flight
+
+    assert asyncio.run(main()).stats()["computations"] == 3
+
+
+def test_errors_are_shared_and_not_cached():
+    def fail():
+        time.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(
+            flight.run("key", fail), flight.run("key", fail), return_exceptions=True
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+        assert await flight.run("key", lambda: "ok") == "ok"
+        return flight
+
+    assert asyncio.run(main()).stats()["computations"] == 2
+
+
+def test_cancelled_waiter_does_not_cancel_shared_computation():
+    async def main():
+        flight = SingleFlight()
+        first = asyncio.ensure_future(flight.run("key", time.sleep, 0.05))
+        second = asyncio.ensure_future(flight.run("key", time.sleep, 0.05))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second is None
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(main())
+
+
+def test_time_bucket_truncates_and_keeps_timezone():
+    dt = datetime(2025, 8, 12, 21, 34, 56, 789, tzinfo=timezone(timedelta(hours=9)))
+    bucket = time_bucket(dt, 60)
+    assert bucket == datetime(2025, 8, 12, 21, 34, tzinfo=timezone(timedelta(hours=9)))
+    assert bucket.tzinfo == dt.tzinfo
+    assert time_bucket(dt.replace(second=3), 60) == bucket
+    assert quantize(35.6812, 0.01) == quantize(35.6789, 0.01) == 3568
@@ -0,0 +1,120 @@
+import csv
+import shutil
+
+import pytest
+from sqlalchemy import text
+
+import catalog_store
+import init_db
+from catalog_store import get_catalog_store, load_catalog_store
+from catalog_store import reload_catalog_store_if_changed, set_catalog_store
+from models import ConstellationLine, Star
+
+
+def _rewrite_stars_csv(tmp_path, monkeypatch, edit):
+    """stars.csv の一時コピーを編集して読み込み先を差し替える"""
+    path = tmp_path / "stars.csv"
+    shutil.copy(init_db.STARS_CSV, path)
+    with open(path, encoding="utf-8") as file:
+        reader = csv.DictReader(file)
+        fieldnames = reader.fieldnames
+        rows = edit(list(reader))
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    monkeypatch.setattr(init_db, "STARS_CSV", str(path))
+
+
+def test_rerun_without_changes_is_noop(session_factory):
+    db = session_factory()
+    try:
+        ids = sorted(star.id for star in db.query(Star))
+        counts = init_db.update_database(db)
+        assert counts == {"inserted": 0, "updated": 0, "deleted": 0}
+        assert sorted(star.id for star in db.query(Star)) == ids
+    finally:
+        db.close()
+
+
+def test_applies_only_the_diff(session_factory, tmp_path, monkeypatch):
+    def edit(rows):
+        rows[0]["magnitude"] = "0.5"  # Betelgeuse を更新
+        return [row for row in rows if row["name"] != "Rigel"]  # Rigel を削除
+
+    db = session_factory()
+    try:
+        betelgeuse_id = db.query(Star).filter(Star.name == "Betelgeuse").one().id
+        line_count = db.query(ConstellationLine).count()
+        _rewrite_stars_csv(tmp_path, monkeypatch, edit)
+
+        counts = init_db.update_database(db)
+
+        assert counts["inserted"] == 0
+        assert counts["updated"] == 1
+        assert counts["deleted"] >= 1
+        assert counts["version"] == 2
+        betelgeuse = db.query(Star).filter(Star.name == "Betelgeuse").one()
+        assert betelgeuse.id == betelgeuse_id
+        assert betelgeuse.magnitude == 0.5
+        assert db.query(Star).filter(Star.name == "Rigel").count() == 0
+        assert db.query(ConstellationLine).count() < line_count
+    finally:
+        db.close()
+
+
+def test_reload_swaps_snapshot_on_new_version(session_factory, tmp_path, monkeypatch):
+    try:
+        old_store = load_catalog_store(session_factory)
+        assert reload_catalog_store_if_changed(session_factory) is None
+
+        _rewrite_stars_csv(tmp_path, monkeypatch, lambda rows: rows[1:])
+        db = session_factory()
+        try:
+            init_db.update_database(db)
+        finally:
+            db.close()
+
+        new_store = reload_catalog_store_if_changed(session_factory)
+        assert new_store is get_catalog_store()
+        assert new_store.version == old_store.version + 1
+        assert len(new_store.stars) == len(old_store.stars) - 1
+        # 差し替え前のスナップショットはそのまま読める
+        assert old_store.search_stars("betelgeuse")
+        assert not new_store.search_stars("betelgeuse")
+    finally:
+        set_catalog_store(None)
+
+
+def test_torn_load_keeps_current_snapshot(session_factory, monkeypatch):
+    try:
+        current = load_catalog_store(session_factory)
+        versions = iter(range(100, 200))
+        # 読み込みのたびにバージョンが進む（常に更新中）状態を再現する
+        monkeypatch.setattr(
+            catalog_store, "read_catalog_version", lambda db: next(versions)
+        )
+
+        with pytest.raises(RuntimeError):
+            load_catalog_store(session_factory)
+        assert get_catalog_store() is current
+    finally:
+        set_catalog_store(None)
+
+
+def test_database_without_version_table_still_loads(session_factory):
+    # バージョン管理の導入前に作られたDBを再現する
+    db = session_factory()
+    try:
+        db.execute(text("DROP TABLE catalog_version"))
+        db.commit()
+    finally:
+        db.close()
+
+    try:
+        store = load_catalog_store(session_factory)
+        assert store.version is None
+        assert store.search_stars("betelgeuse")
+        assert reload_catalog_store_if_changed(session_factory) is None
+    finally:
+        set_catalog_store(None)
@@ -0,0 +1,169 @@
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+from sgp4.api import SatrecArray
+from skyfield.api import EarthSatellite, wgs84
+from skyfield.positionlib import build_position
+
+import satellites
+from horizon import enu_matrix
+from satellites import SatelliteCatalog, load_satellites, predict_passes
+
+ISS_TLE = os.path.join(os.path.dirname(__file__), "data", "iss.tle")
+START = datetime(2014, 1, 21, tzinfo=timezone.utc)
+TOKYO = (35.68, 139.76, 0)
+LONDON = (51.5, 0.0, 0)
+
+
+class StubEphemeris:
+    """簡易式で太陽の地心位置を返す天体暦の代わり（精度は約0.01度）"""
+
+    class _Earth:
+        def at(self, t):
+            return StubEphemeris._Observer(t)
+
+    class _Observer:
+        def __init__(self, t):
+            self.t = t
+
+        def observe(self, body):
+            n = self.t.tt - 2451545.0
+            g = np.radians(357.528 + 0.9856003 * n)
+            lam = np.radians(
+                280.460 + 0.9856474 * n + 1.915 * np.sin(g) + 0.020 * np.sin(2 * g)
+            )
+            eps = np.radians(23.439 - 0.0000004 * n)
+            r = 1.00014 - 0.01671 * np.cos(g) - 0.00014 * np.cos(2 * g)
+            position = [
+                r * np.cos(lam),
+                r * np.cos(eps) * np.sin(lam),
+                r * np.sin(eps) * np.sin(lam),
+            ]
+            return build_position(np.array(position), t=self.t, center=399)
+
+    def __getitem__(self, name):
+        return self._Earth() if name == "earth" else name
+
+
+def test_passes_match_skyfield():
+    catalog = load_satellites(ISS_TLE)
+    passes = predict_passes(catalog, *TOKYO, START, hours=24, min_altitude=10)
+
+    assert passes
+    with open(ISS_TLE) as file:
+        name, line1, line2 = file.read().splitlines()
+    satellite = EarthSatellite(line1, line2, name, satellites.ts)
+    topos = wgs84.latlon(*TOKYO)
+    for p in passes:
+        assert p["name"] == "ISS (ZARYA)"
+        assert p["catalog_number"] == 25544
+        assert (
+            p["rise"]["datetime"]
+            <= p["culmination"]["datetime"]
+            <= p["set"]["datetime"]
+        )
+        assert p["visible"] is None
+        assert p["truncated"] is False
+        peak = p["culmination"]
+        t = satellites.ts.from_datetime(datetime.fromisoformat(peak["datetime"]))
+        alt, az, _ = (satellite - topos).at(t).altaz()
+        assert peak["altitude"] == pytest.approx(alt.degrees, abs=0.01)
+        assert peak["azimuth"] == pytest.approx(az.degrees, abs=0.05)
+
+
+def test_many_satellites_are_propagated_in_chunks(monkeypatch):
+    # 24時間を30秒間隔で計算すると2881時刻なので、3衛星ずつ伝搬される
+    monkeypatch.setattr(satellites, "PROPAGATION_BUDGET", 3 * 2881)
+    sizes = []
+
+    def satrec_array(satrecs):
+        sizes.append(len(satrecs))
+        return SatrecArray(satrecs)
+
+    monkeypatch.setattr(satellites, "SatrecArray", satrec_array)
+    iss = load_satellites(ISS_TLE)
+    catalog = SatelliteCatalog([(iss.names[0], iss.satrecs[0])] * 7)
+
+    passes = predict_passes(catalog, *TOKYO, START, hours=24)
+    assert sizes == [3, 3, 1]
+    single = predict_passes(iss, *TOKYO, START, hours=24)
+    assert len(passes) == 7 * len(single)
+
+
+def test_too_many_time_steps_are_rejected():
+    catalog = load_satellites(ISS_TLE)
+    with pytest.raises(ValueError):
+        predict_passes(catalog, *TOKYO, START, hours=24, step_seconds=1)
+
+
+def test_parsed_satellites_are_cached_until_file_changes(tmp_path):
+    path = tmp_path / "stations.tle"
+    shutil.copy(ISS_TLE, path)
+
+    first = load_satellites(str(tmp_path))
+    assert load_satellites(str(tmp_path)) is first
+    assert first.select("zarya").names == ["ISS (ZARYA)"]
+    assert len(first.select("starlink")) == 0
+
+    with open(path, "a") as file:
+        file.write(open(ISS_TLE).read().replace("ISS (ZARYA)", "ISS COPY"))
+    second = load_satellites(str(tmp_path))
+    assert second is not first
+    assert second.names == ["ISS (ZARYA)", "ISS COPY"]
+
+
+def test_missing_tle_path_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        load_satellites(str(tmp_path / "missing.tle"))
+
+
+def test_sun_geometry_gives_sun_altitude():
+    # 1月21日のロンドンの南中時の太陽高度は 90 - 51.5 - 20.0 度
+    noon = satellites.ts.from_datetime(
+        datetime(2014, 1, 21, 12, 11, tzinfo=timezone.utc)
+    )
+    location = np.asarray(wgs84.latlon(*LONDON).itrs_xyz.km)
+    enu = enu_matrix(*LONDON[:2])
+    _, sun_altitude = satellites._sun_geometry(StubEphemeris(), noon, location, enu)
+    assert sun_altitude == pytest.approx(18.5, abs=0.3)
+
+
+def test_visible_requires_dark_sky_and_sunlit_satellite():
+    catalog = load_satellites(ISS_TLE)
+    passes = predict_passes(
+        catalog, *LONDON, START, hours=10, min_altitude=10, eph=StubEphemeris()
+    )
+
+    # 深夜は地球の影の中、夜明け前は日照中で空が暗く、日の出後は空が明るい
+    rises = [p["rise"]["datetime"][11:16] for p in passes]
+    assert rises == ["01:50", "03:25", "05:02", "06:38", "08:16"]
+    assert [p["visible"] for p in passes] == [False, False, True, True, False]
+
+
+def test_passes_at_window_edges_are_truncated():
+    catalog = load_satellites(ISS_TLE)
+    # 15:40（UTC）に出るパスの途中から予測を始め、途中で終える
+    start = datetime(2014, 1, 21, 15, 43, tzinfo=timezone.utc)
+    (head,) = predict_passes(catalog, *TOKYO, start, hours=0.5)
+    (tail,) = predict_passes(
+        catalog, *TOKYO, start - timedelta(minutes=10), hours=10 / 60 + 0.01
+    )
+
+    assert head["truncated"] and head["rise"] is None and head["set"] is not None
+    assert tail["truncated"] and tail["rise"] is not None and tail["set"] is None
+    assert head["culmination"]["datetime"] >= start.isoformat()
+
+
+def test_sunlit_uses_cylindrical_shadow():
+    sun = np.array([[1.0, 0.0, 0.0]])
+    itrf = np.array(
+        [
+            [[7000.0, 0.0, 0.0]],  # 太陽側
+            [[-7000.0, 0.0, 0.0]],  # 地球の影の中
+            [[-7000.0, 0.0, 7000.0]],  # 影の外
+        ]
+    )
+    assert satellites._sunlit(itrf, sun)[:, 0].tolist() == [True, False, True]
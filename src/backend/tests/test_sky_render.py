@@ -0,0 +1,67 @@
+import io
+
+import numpy as np
+from PIL import Image
+from skyfield.api import load
+
+from catalog_store import CatalogStore
+from sky_render import TileCache, render_sky
+
+TOKYO = (35.68, 139.76)
+
+
+def _store(session_factory):
+    db = session_factory()
+    try:
+        return CatalogStore.from_session(db)
+    finally:
+        db.close()
+
+
+def _render(store, **kwargs):
+    # 2025-01-15 21:00 JST、オリオン座が南の空に見える
+    t = load.timescale().utc(2025, 1, 15, 12)
+    data = render_sky(store, *TOKYO, t, **kwargs)
+    return Image.open(io.BytesIO(data))
+
+
+def test_renders_visible_stars_and_lines(session_factory):
+    store = _store(session_factory)
+    south = np.asarray(_render(store, center_azimuth=180, center_altitude=40))
+    no_lines = np.asarray(
+        _render(store, center_azimuth=180, center_altitude=40, lines=False)
+    )
+
+    assert south.shape == (512, 512, 3)
+    # 明るい星が描かれ、星座線の有無で画像が変わる
+    assert (south.max(axis=2) > 200).sum() > 0
+    assert (south != no_lines).any()
+    # 視線の下側（地平線より下）は地面の色
+    assert tuple(south[-1, 256]) != tuple(south[0, 256])
+
+
+def test_magnitude_limit_hides_faint_stars(session_factory):
+    store = _store(session_factory)
+    bright_only = np.asarray(
+        _render(store, center_azimuth=180, magnitude_limit=-5, lines=False)
+    )
+    assert (bright_only.max(axis=2) > 150).sum() == 0
+
+
+def test_webp_output(session_factory):
+    image = _render(_store(session_factory), width=128, height=64, image_format="webp")
+    assert image.format == "WEBP"
+    assert image.size == (128, 64)
+
+
+def test_tile_cache_evicts_least_recently_used():
+    cache = TileCache(max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234"
+    assert cache.get("c") == b"1234"
+    assert cache.stats() == {"tiles": 2, "bytes": 8, "hits": 3, "misses": 1}
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from skyfield.api import load
+
+from catalog_store import STAR_DTYPE, CatalogStore
+from star_index import StarIndex, altaz_to_radec, radec_to_vectors
+
+
+def _random_stars(count, seed=0):
+    rng = np.random.default_rng(seed)
+    stars = np.zeros(count, dtype=STAR_DTYPE)
+    stars["id"] = np.arange(1, count + 1)
+    stars["right_ascension"] = rng.uniform(0, 360, count)
+    stars["declination"] = np.degrees(np.arcsin(rng.uniform(-1, 1, count)))
+    stars["magnitude"] = rng.uniform(-1, 9, count)
+    return stars
+
+
+def _brute_force(stars, ra, dec, limit, magnitude_limit):
+    separations = np.degrees(
+        np.arccos(
+            np.clip(
+                radec_to_vectors(stars["right_ascension"], stars["declination"])
+                @ radec_to_vectors(ra, dec),
+                -1,
+                1,
+            )
+        )
+    )
+    separations[stars["magnitude"] > magnitude_limit] = np.inf
+    return np.argsort(separations)[:limit]
+
+
+@pytest.mark.parametrize("magnitude_limit", [None, -0.5, 2.0, 5.3, 8.99])
+def test_query_matches_brute_force_with_magnitude_limit(magnitude_limit):
+    # 複数のブロックと総当たりの末尾にまたがる大きさ
+    stars = _random_stars(20_000)
+    index = StarIndex(stars)
+    ra = np.array([0.0, 88.79, 359.9, 180.0])
+    dec = np.array([89.9, 7.4, -45.0, 0.0])
+
+    results = index.query(ra, dec, limit=3, magnitude_limit=magnitude_limit)
+
+    cutoff = np.inf if magnitude_limit is None else magnitude_limit
+    for (rows, separations), r, d in zip(results, ra, dec):
+        assert rows.tolist() == _brute_force(stars, r, d, 3, cutoff).tolist()
+        assert np.all(np.diff(separations) >= 0)
+        assert np.all(stars["magnitude"][rows] <= cutoff)
+
+
+def test_cutoff_matching_no_stars_on_large_catalog():
+    stars = _random_stars(100_000)
+    index = StarIndex(stars)
+    rng = np.random.default_rng(1)
+    ra = rng.uniform(0, 360, 10_000)
+    dec = rng.uniform(-90, 90, 10_000)
+
+    results = index.query(ra, dec, limit=5, magnitude_limit=-5)
+
+    assert len(results) == 10_000
+    assert all(
+        len(rows) == 0 and len(separations) == 0 for rows, separations in results
+    )
+    # 明るい星がごく少ない場合もその星だけを返す
+    brightest = np.sort(stars["magnitude"])[2]
+    for rows, _ in index.query(ra[:100], dec[:100], limit=5, magnitude_limit=brightest):
+        assert len(rows) == 3
+
+
+def test_query_returns_fewer_when_not_enough_stars_are_bright():
+    stars = _random_stars(100)
+    rows, _ = StarIndex(stars).query(10.0, 10.0, limit=5, magnitude_limit=-0.9)[0]
+    assert len(rows) == np.count_nonzero(stars["magnitude"] <= -0.9)
+
+
+def test_nearest_stars_identifies_betelgeuse(session_factory):
+    db = session_factory()
+    try:
+        store = CatalogStore.from_session(db)
+    finally:
+        db.close()
+
+    [stars] = store.nearest_stars(88.8, 7.4, limit=2)
+    assert stars[0]["name"] == "Betelgeuse"
+    assert stars[0]["separation"] < 0.1
+    assert stars[1]["separation"] >= stars[0]["separation"]
+
+
+def test_altaz_to_radec_zenith_is_at_observer_latitude():
+    ts = load.timescale()
+    ra, dec = altaz_to_radec(35.68, 139.76, 0, ts.utc(2025, 8, 12, 12), 90.0, 0.0)
+    assert abs(float(dec) - 35.68) < 0.5